@@ -2,19 +2,32 @@
 import os
 import sys
 import json
+import collections
 import time
-import glob
-import shlex
 import pathlib
 import re
 import datetime
+import functools
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 import google.oauth2.credentials
+from PIL import Image, ImageOps
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+try:
+    from inotify_simple import INotify, flags as inotify_flags  # optional: pip install inotify_simple
+except ImportError:
+    INotify = None
 
 # Ensure UTF-8 stdout (Pi sometimes needs this)
 try:
@@ -57,125 +70,282 @@ IMAGE_KEYWORDS = [
 
 SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
 DRY_RUN = False  # set to False to actually upload
+UPLOAD_CHUNKSIZE = 16*1024*1024  # bytes per resumable PUT
+UPLOAD_RETRIES   = 5             # next_chunk(num_retries=...): randomized backoff on 5xx/429
+HW_ENCODE = True  # use the Pi's h264_v4l2m2m hardware encoder when ffmpeg has it (falls back to libx264)
 
 # ---------- Helpers for video & archive handling ----------
-def ffprobe_duration(path: pathlib.Path) -> float:
-    """Return duration in seconds using ffprobe; -1 if unavailable."""
+def probe(path) -> dict:
+    """Return {'duration','w','h','fps'} for a video from one ffprobe call, cached by (path, mtime, size)."""
+    st = os.stat(path)
+    return _probe_cached(str(path), st.st_mtime_ns, st.st_size)
+
+@functools.lru_cache(maxsize=256)
+def _probe_cached(path: str, mtime_ns: int, size: int) -> dict:
+    info = {"duration": -1.0, "w": 1280, "h": 720, "fps": 25.0}
     try:
-        cmd = f'ffprobe -v error -show_entries format=duration -of default=nokey=1:noprint_wrappers=1 {shlex.quote(str(path))}'
-        out = subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL, text=True).strip()
-        return float(out)
+        res = subprocess.run(
+            ["ffprobe","-v","error","-print_format","json",
+             "-show_format","-show_streams","-select_streams","v:0", path],
+            capture_output=True, text=True
+        )
+        data = json.loads(res.stdout)
     except Exception:
-        return -1.0
-
-def probe_video_dims_fps(path):
-    """Return (w,h,fps) for a video; fallback 1280x720@25 if probe fails."""
+        return info
     try:
-        out = subprocess.check_output(
-            ["ffprobe","-v","error","-select_streams","v:0",
-             "-show_entries","stream=width,height,r_frame_rate",
-             "-of","default=nw=1:nk=1", str(path)],
-            text=True
-        ).strip().splitlines()
-        w = int(out[0]); h = int(out[1]); fr = out[2]  # e.g. '25/1'
-        num, den = fr.split("/")
-        fps = float(num) / float(den) if float(den) != 0 else 25.0
-        if not (1 <= fps <= 120): fps = 25.0
-        return w, h, fps
-    except Exception:
-        return 1280, 720, 25.0
+        info["duration"] = float(data["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        pass
+    streams = data.get("streams") or []
+    if streams:
+        st = streams[0]
+        try:
+            w, h = int(st["width"]), int(st["height"])
+            num, den = st.get("r_frame_rate", "25/1").split("/")  # e.g. '25/1'
+            fps = float(num) / float(den) if float(den) != 0 else 25.0
+            if not (1 <= fps <= 120): fps = 25.0
+            info.update(w=w, h=h, fps=fps)
+        except (KeyError, TypeError, ValueError):
+            pass
+    return info
 
-_meteors_re = re.compile(r"(?:stack|stac)[_-]?(\d+)_meteors\.jpg$", re.IGNORECASE)
+_meteors_re = re.compile(r"(?:stack|stac)[_-]?(\d+)_meteors\.jpg$", re.IGNORECASE | re.ASCII)
+_METEORS_SUFFIX = "_meteors.jpg"
 
 def has_meteors(night_dir: pathlib.Path):
     """Return (True, max_count) if any stack_X_meteors.jpg (X≥1) exists in the night dir tree; else (False, None)."""
     best = None
-    for root, _, files in os.walk(night_dir):
-        for name in files:
-            if name.lower().endswith("_meteors.jpg"):
+    queue = collections.deque([str(night_dir)])
+    while queue:
+        try:
+            it = os.scandir(queue.popleft())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):  # d_type from getdents, no stat
+                    queue.append(entry.path)
+                    continue
+                name = entry.name
+                # cheap suffix check on a slice (no full-name lowercase copy) before the regex
+                if name[-len(_METEORS_SUFFIX):].lower() != _METEORS_SUFFIX:
+                    continue
                 m = _meteors_re.search(name)
                 if m:
                     try:
                         x = int(m.group(1))
-                        if x >= 1:
-                            best = x if best is None else max(best, x)
                     except ValueError:
-                        pass
+                        continue
+                    if x >= 1:
+                        best = x if best is None else max(best, x)
     return (best is not None, best)
 
-TIMELAPSE_GLOBS = [
-    "images/timelapse*.mp4",
-    "images/images*.mp4",
-    "video/*timelapse*.mp4",
-    "video/*.mp4",
-    "*timelapse*.mp4",
-    "*.mp4",
+# Where to look for the timelapse, tried in order until one tier matches:
+# (subdir of night folder, substring the name must contain or None for any .mp4)
+TIMELAPSE_TIERS = [
+    ("images", "timelapse"),
+    ("video",  "timelapse"),
+    ("images", None),
 ]
+# Our own outputs (written next to the timelapse) must never be picked up as the timelapse
+OUTPUT_NAMES = {"images.mp4", "final_with_images.mp4"}
+
+def _list_mp4s(d: str):
+    """Return [(name, size, path)] for the .mp4 files in d, excluding our own outputs."""
+    out = []
+    try:
+        it = os.scandir(d)
+    except OSError:
+        return out
+    with it:
+        for entry in it:
+            name = entry.name
+            if name.startswith(".") or not name.endswith(".mp4"):
+                continue
+            if name in OUTPUT_NAMES or ".noaudio." in name:
+                continue
+            if entry.is_file():
+                out.append((name, entry.stat().st_size, entry.path))
+    return out
 
 def find_timelapse(night_dir: pathlib.Path):
-    """Return the most plausible timelapse for the given night folder."""
-    candidates = []
-    for pat in TIMELAPSE_GLOBS:
-        candidates += [pathlib.Path(p) for p in glob.glob(str(night_dir / pat))]
-    # de-dupe and keep existing
-    seen, uniq = set(), []
-    for v in candidates:
-        if v.exists() and v not in seen:
-            uniq.append(v); seen.add(v)
-    if not uniq:
-        return None
-    # Prefer in images/, then by size
-    uniq.sort(key=lambda p: (0 if "images" in p.as_posix() else 1, -p.stat().st_size))
-    return uniq[0]
+    """Return the most plausible timelapse for the given night folder: the largest file of the first tier that matches."""
+    listings = {}  # subdir -> _list_mp4s result, so each directory is read at most once
+    for sub, needle in TIMELAPSE_TIERS:
+        if sub not in listings:
+            listings[sub] = _list_mp4s(os.path.join(night_dir, sub))
+        candidates = [c for c in listings[sub] if needle is None or needle in c[0]]
+        if candidates:
+            return pathlib.Path(max(candidates, key=lambda c: c[1])[2])
+    return None
 
 _date_in_name = re.compile(r"^[A-Z0-9]+_(\d{8})_")
 
+_groups_cache = {}  # (archive_dir, mtime_ns) -> groups
+
 def group_night_folders_by_date(archive_dir: pathlib.Path):
     """Return dict {'YYYYMMDD': [night_dir1, night_dir2, ...]} for flat ArchivedFiles."""
+    key = (str(archive_dir), os.stat(archive_dir).st_mtime_ns)
+    if key in _groups_cache:
+        return _groups_cache[key]
     groups = {}
-    for p in archive_dir.iterdir():
-        if not p.is_dir():
-            continue
-        m = _date_in_name.match(p.name)
-        if not m:
-            continue
-        yyyymmdd = m.group(1)
-        groups.setdefault(yyyymmdd, []).append(p)
+    with os.scandir(archive_dir) as it:
+        for entry in it:
+            m = _date_in_name.match(entry.name)
+            if not m or not entry.is_dir(follow_symlinks=False):
+                continue
+            yyyymmdd = m.group(1)
+            groups.setdefault(yyyymmdd, []).append(pathlib.Path(entry.path))
+    _groups_cache[key] = groups
     return groups
 
-def pick_best_folder_for_date(archive_dir: pathlib.Path, yyyymmdd: str, require_meteors=True):
-    """Return (night_folder, video_path, meteors_count or None) for a given date."""
-    groups = group_night_folders_by_date(archive_dir)
+def scan_night_folder(night_dir: pathlib.Path):
+    """Return (video, has_meteors, meteors_count, video_stat) for a night folder, or None if it has no timelapse."""
+    v = find_timelapse(night_dir)
+    if not v:
+        return None
+    ok, mc = has_meteors(night_dir)
+    return v, ok, mc, v.stat()
+
+def pick_best_folder_for_date(archive_dir: pathlib.Path, yyyymmdd: str, require_meteors=True, groups=None):
+    """Return (night_folder, video_path, meteors_count or None, any_timelapse) for a given date.
+
+    any_timelapse says whether any candidate folder had a timelapse at all, even if none qualified.
+    """
+    if groups is None:
+        groups = group_night_folders_by_date(archive_dir)
     candidates = groups.get(yyyymmdd, [])
-    best = None  # (duration, size, mtime, folder, video, meteors_count)
-    for d in candidates:
-        v = find_timelapse(d)
-        if not v:
+    if not candidates:
+        return None, None, None, False
+    if len(candidates) > 1:
+        # Duplicate-night folders scan independently and are I/O-bound, so run them concurrently
+        with ThreadPoolExecutor(max_workers=min(4, len(candidates))) as ex:
+            scanned = list(ex.map(scan_night_folder, candidates))
+    else:
+        scanned = [scan_night_folder(candidates[0])]
+    best = None  # (size, mtime, folder, video, meteors_count)
+    for d, res in zip(candidates, scanned):
+        if res is None:
             continue
-        ok, mc = has_meteors(d)
+        v, ok, mc, st = res
         if require_meteors and not ok:
             continue
-        dur = ffprobe_duration(v)
-        size = v.stat().st_size
-        mtime = v.stat().st_mtime
-        key = (dur if dur > 0 else 0, size, mtime)
-        if best is None or key > best[:3]:
-            best = (key[0], key[1], key[2], d, v, mc)
+        # Rank on size/mtime only; the largest timelapse is the complete one, so
+        # only the winner needs ffprobe (done once by the caller via probe()).
+        key = (st.st_size, st.st_mtime)
+        if best is None or key > best[:2]:
+            best = (key[0], key[1], d, v, mc)
+    any_timelapse = any(res is not None for res in scanned)
     if best:
-        return best[3], best[4], best[5]
-    return None, None, None
-
-def pick_latest_night(archive_dir: pathlib.Path, require_meteors=True):
-    """Pick the most recent date that has a valid folder/video (and meteors if required)."""
+        return best[2], best[3], best[4], any_timelapse
+    return None, None, None, any_timelapse
+
+def folders_mtime_ns(folders) -> int:
+    """Newest mtime_ns across a date's night folders and their timelapse subdirs (images/, video/).
+
+    A directory's mtime only changes when entries are added/removed directly in it, so the subdirs where the
+    timelapse and stacks appear have to be included for this to notice them.
+    """
+    subdirs = {sub for sub, _ in TIMELAPSE_TIERS}
+    mtimes = []
+    for f in folders:
+        for d in [f] + [os.path.join(f, sub) for sub in subdirs]:
+            try:
+                mtimes.append(os.stat(d).st_mtime_ns)
+            except OSError:
+                pass
+    return max(mtimes, default=0)
+
+def pick_latest_night(archive_dir: pathlib.Path, require_meteors=True, finalized=None):
+    """Pick the most recent date that has a valid folder/video (and meteors if required).
+
+    finalized is the state's {'YYYYMMDD': {'uploaded', 'mtime_ns'}} map. Dates in it whose folders are unchanged
+    are not rescanned: an uploaded one returns (yyyymmdd, None, None, None), a meteor-less one is skipped.
+    Newly found dates that have a timelapse but no meteors are added to it (a date with no timelapse yet is
+    not, since RMS may still be producing it), and dates no longer in the archive are pruned.
+    """
     groups = group_night_folders_by_date(archive_dir)
+    if finalized is not None:
+        for d in [d for d in finalized if d not in groups]:
+            del finalized[d]
     if not groups:
         return None, None, None, None  # (yyyymmdd, folder, video, meteors_count)
     for yyyymmdd in sorted(groups.keys(), reverse=True):
-        folder, video, mc = pick_best_folder_for_date(archive_dir, yyyymmdd, require_meteors=require_meteors)
+        mtime_ns = folders_mtime_ns(groups[yyyymmdd]) if finalized is not None else None
+        done = finalized.get(yyyymmdd) if finalized is not None else None
+        if done and done.get("mtime_ns") == mtime_ns:
+            if done.get("uploaded"):
+                return yyyymmdd, None, None, None
+            continue
+        folder, video, mc, any_timelapse = pick_best_folder_for_date(
+            archive_dir, yyyymmdd, require_meteors=require_meteors, groups=groups)
         if folder and video:
             return yyyymmdd, folder, video, mc
+        if finalized is not None and any_timelapse:
+            finalized[yyyymmdd] = {"uploaded": False, "mtime_ns": mtime_ns}
     return None, None, None, None
 
+def mark_date_uploaded(state: dict, archive_dir: pathlib.Path, yyyymmdd: str):
+    """Record yyyymmdd as uploaded in state['finalized_dates'] so later runs stop at it without rescanning."""
+    folders = group_night_folders_by_date(archive_dir).get(yyyymmdd, [])
+    state.setdefault("finalized_dates", {})[yyyymmdd] = {"uploaded": True, "mtime_ns": folders_mtime_ns(folders)}
+
+# All IMAGE_KEYWORDS as one alternation; the named group g<i> says which keyword hit
+_image_kw_re = re.compile("|".join(f"(?P<g{i}>{re.escape(k)})" for i, k in enumerate(IMAGE_KEYWORDS)))
+
+def find_images(folder: pathlib.Path):
+    """Return the first file matching each IMAGE_KEYWORDS entry, in keyword order, from one listing of folder."""
+    matches = [None] * len(IMAGE_KEYWORDS)
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                m = _image_kw_re.search(entry.name)
+                if m:
+                    idx = int(m.lastgroup[1:])
+                    if matches[idx] is None:
+                        matches[idx] = pathlib.Path(entry.path)
+    except FileNotFoundError:
+        pass
+    return [p for p in matches if p]
+
+def last_upload_is_latest(archive_dir: pathlib.Path, state: dict) -> bool:
+    """Cheap no-op check: True if the last uploaded timelapse is unchanged (mtime/size) and its date is still the newest."""
+    try:
+        st = os.stat(state["last_filepath"])
+        if (st.st_mtime_ns, st.st_size) != (state["last_mtime_ns"], state["last_size"]):
+            return False
+        last_date = state["last_date"]
+    except (KeyError, OSError):
+        return False  # no upload yet, file gone, or state from an older version
+    groups = group_night_folders_by_date(archive_dir)
+    # A new night, or a new duplicate folder for the same night, needs the full pick
+    return bool(groups) and max(groups) == last_date \
+        and len(groups[last_date]) == state.get("last_date_folders")
+
+def file_still_growing(path: pathlib.Path) -> bool:
+    """True if the file is still being written: held write lock, inotify MODIFY within 1s, else a 3s size check."""
+    if fcntl:
+        try:
+            with open(path, "rb") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)  # released on close
+        except BlockingIOError:
+            return True  # writer holds an exclusive lock
+        except OSError:
+            pass
+    size1 = os.stat(path).st_size
+    if INotify is not None:
+        try:
+            with INotify() as ino:
+                ino.add_watch(str(path), inotify_flags.MODIFY | inotify_flags.CLOSE_WRITE)
+                events = ino.read(timeout=1000)
+            if any(e.mask & inotify_flags.MODIFY for e in events):
+                return True
+            return os.stat(path).st_size != size1
+        except OSError:
+            pass
+    time.sleep(3)
+    return os.stat(path).st_size != size1
+
 # ---------- Auth & state ----------
 def get_credentials():
     creds = None
@@ -191,54 +361,112 @@ def get_credentials():
             f.write(creds.to_json())
     return creds
 
+def get_youtube():
+    creds = get_credentials()
+    # Use the discovery document bundled with google-api-python-client (no HTTPS fetch, no file cache)
+    return build("youtube", "v3", credentials=creds, static_discovery=True, cache_discovery=False)
+
 def load_state():
+    state = {}
     if os.path.exists(STATE_PATH):
         try:
             with open(STATE_PATH, "r") as f:
-                return json.load(f)
+                state = json.load(f)
         except Exception:
-            return {}
-    return {}
+            state = {}
+    state.setdefault("finalized_dates", {})  # {'YYYYMMDD': {'uploaded': bool, 'mtime_ns': int}}
+    return state
 
 def save_state(state: dict):
+    # Write to a temp file and rename over the old one, so a kill mid-write (e.g. during an upload)
+    # can never leave a truncated state file that load_state would silently read as {}.
     os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
-    with open(STATE_PATH, "w") as f:
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
         json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, STATE_PATH)
+
+def record_upload(state: dict, archive_dir: pathlib.Path, source_video: pathlib.Path, yyyymmdd: str, vid: str):
+    """Save a finished upload of source_video (the night's timelapse) to state."""
+    st = source_video.stat()
+    state["last_filepath"] = str(source_video.resolve())
+    state["last_mtime_ns"] = st.st_mtime_ns
+    state["last_size"] = st.st_size
+    state["last_date"] = yyyymmdd
+    state["last_date_folders"] = len(group_night_folders_by_date(archive_dir).get(yyyymmdd, []))
+    state["last_video_id"] = vid
+    mark_date_uploaded(state, archive_dir, yyyymmdd)
+    save_state(state)
 
 # ---------- Video building ----------
+def x264_args(preset="ultrafast", still=False):
+    """libx264 speed/quality args. YouTube transcodes every upload anyway, so CRF 23 at a fast preset is plenty."""
+    args = ["-c:v","libx264","-preset", preset, "-crf","23"]
+    if still:
+        args += ["-tune","stillimage"]
+    return args + ["-threads", str(os.cpu_count() or 1), "-x264-params","sliced-threads=1"]
+
+@functools.lru_cache(maxsize=None)
+def hw_encoder_available() -> bool:
+    """True if this ffmpeg build lists the h264_v4l2m2m (Pi VPU) encoder."""
+    try:
+        out = subprocess.run(["ffmpeg","-hide_banner","-encoders"],
+                             capture_output=True, text=True).stdout
+    except Exception:
+        return False
+    return any(line.split()[1:2] == ["h264_v4l2m2m"] for line in out.splitlines())
+
+def run_encode(make_cmd, preset="ultrafast", still=False, hw=True):
+    """Run make_cmd(encoder_args); try the hardware encoder first if allowed, else/then libx264."""
+    if hw and HW_ENCODE and hw_encoder_available():
+        cmd = make_cmd(["-c:v","h264_v4l2m2m","-b:v","4M"])
+        print("Running:", " ".join(cmd))
+        if subprocess.run(cmd).returncode == 0:
+            return
+        print("Hardware encode failed; falling back to libx264.")
+    cmd = make_cmd(x264_args(preset, still=still))
+    print("Running:", " ".join(cmd))
+    subprocess.run(cmd, check=True)
+
 def build_slideshow(images, output_path, target_w=1280, target_h=720, target_fps=25.0):
     """Create a slideshow from stills (3s each), scaled/letterboxed to target size/fps."""
     if not images:
         return None
-    inputs, filters = [], []
-    for i, img in enumerate(images):
-        inputs += ["-loop","1","-t","3","-i", str(img)]
-        filters.append(
-            f"[{i}:v]fps={target_fps},scale={target_w}:{target_h}:force_original_aspect_ratio=decrease,"
-            f"pad={target_w}:{target_h}:(ow-iw)/2:(oh-ih)/2,setsar=1[v{i}]"
-        )
-    n = len(images)
-    filter_complex = ";".join(filters) + ";" + "".join(f"[v{i}]" for i in range(n)) \
-                     + f"concat=n={n}:v=1:a=0,format=yuv420p[vout]"
-    cmd = ["ffmpeg","-y"] + inputs + ["-filter_complex", filter_complex,
-           "-map","[vout]","-r", f"{target_fps}", "-c:v","libx264","-pix_fmt","yuv420p", str(output_path)]
-    print("Running:", " ".join(cmd))
-    subprocess.run(cmd, check=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Letterbox every still to the target size once with Pillow, numbered for the image2 demuxer.
+        # The last still is written twice so it still gets its full 3s before the input ends.
+        for i, img in enumerate(list(images) + [images[-1]], start=1):
+            with Image.open(img) as im:
+                frame = ImageOps.pad(im.convert("RGB"), (target_w, target_h), color=(0, 0, 0))
+            frame.save(os.path.join(tmp, f"frame_{i:04d}.png"), compress_level=1)
+        def make_cmd(enc):
+            return ["ffmpeg","-y","-framerate","1/3","-i", os.path.join(tmp, "frame_%04d.png"),
+                    "-vf", f"fps={target_fps},format=yuv420p", "-t", str(3 * len(images)),
+                    "-r", f"{target_fps}"] + enc + ["-pix_fmt","yuv420p", str(output_path)]
+        run_encode(make_cmd, still=True)
     return output_path
 
+def reencode_concat(main_video, extra_video, output_path, target_fps=25.0):
+    """Concat two videos through the concat filter, re-encoding (hardware H.264 if available)."""
+    def make_cmd(enc):
+        return [
+            "ffmpeg","-y",
+            "-i", str(main_video),
+            "-i", str(extra_video),
+            "-filter_complex","[0:v][1:v]concat=n=2:v=1:a=0,format=yuv420p[v]",
+            "-map","[v]","-r", f"{target_fps}",
+            *enc,
+            "-pix_fmt","yuv420p","-movflags","+faststart",
+            str(output_path)
+        ]
+    run_encode(make_cmd)
+
 def concat_videos(main_video, extra_video, output_path, target_fps=25.0, bg_audio=None):
     """Concat main+slideshow, then optionally add background audio."""
     temp_out = str(output_path) + ".noaudio.mp4"
-    cmd = [
-        "ffmpeg","-y",
-        "-i", str(main_video),
-        "-i", str(extra_video),
-        "-filter_complex","[0:v][1:v]concat=n=2:v=1:a=0,format=yuv420p[v]",
-        "-map","[v]","-r", f"{target_fps}",
-        "-c:v","libx264","-pix_fmt","yuv420p","-movflags","+faststart",
-        temp_out
-    ]
-    subprocess.run(cmd, check=True)
+    reencode_concat(main_video, extra_video, temp_out, target_fps=target_fps)
 
     if bg_audio and os.path.exists(bg_audio):
         cmd = [
@@ -259,9 +487,8 @@ def concat_videos(main_video, extra_video, output_path, target_fps=25.0, bg_audi
     return output_path
 
 # ---------- YouTube upload ----------
-def upload_video(youtube, filepath: pathlib.Path, title: str, desc: str):
-    media = MediaFileUpload(str(filepath), mimetype="video/mp4", resumable=True, chunksize=8*1024*1024)
-    body = {
+def make_upload_body(title: str, desc: str) -> dict:
+    return {
         "snippet": {
             "title": title,
             "description": desc,
@@ -273,12 +500,48 @@ def upload_video(youtube, filepath: pathlib.Path, title: str, desc: str):
             "selfDeclaredMadeForKids": False
         },
     }
+
+def pending_upload_matches(pending: dict) -> bool:
+    """True if the file of a stored pending upload is still exactly the one the session was started with."""
+    try:
+        st = os.stat(pending["filepath"])
+    except (KeyError, OSError):
+        return False
+    return (st.st_mtime_ns, st.st_size) == (pending.get("mtime_ns"), pending.get("size"))
+
+def upload_video(youtube, filepath: pathlib.Path, body: dict, state=None, resumable_uri=None, pending_info=None):
+    """Resumable upload of filepath; returns the video id.
+
+    With state, the session URI is saved to state['pending_upload'] (plus pending_info) after the first chunk,
+    so a killed run can continue it by passing resumable_uri. The entry is removed once the upload completes.
+    """
+    media = MediaFileUpload(str(filepath), mimetype="video/mp4", resumable=True, chunksize=UPLOAD_CHUNKSIZE)
     request = youtube.videos().insert(part="snippet,status", body=body, media_body=media)
+    if resumable_uri:
+        print("Resuming interrupted upload of", filepath)
+        request.resumable_uri = resumable_uri
+        # Private API (checked against google-api-python-client 2.201.0): in error state, next_chunk first
+        # sends an empty PUT to ask the server how many bytes it already has, then continues from there.
+        request._in_error_state = True
     response = None
     while response is None:
-        status, response = request.next_chunk()
+        status, response = request.next_chunk(num_retries=UPLOAD_RETRIES)
+        if response is None and state is not None and request.resumable_uri \
+                and state.get("pending_upload", {}).get("resumable_uri") != request.resumable_uri:
+            st = os.stat(filepath)
+            state["pending_upload"] = {
+                "resumable_uri": request.resumable_uri,
+                "filepath": str(filepath),
+                "mtime_ns": st.st_mtime_ns,
+                "size": st.st_size,
+                "body": body,
+                **(pending_info or {}),
+            }
+            save_state(state)
         if status:
             print(f"Upload progress: {int(status.progress()*100)}%")
+    if state is not None:
+        state.pop("pending_upload", None)
     print("Uploaded video id:", response["id"])
     return response["id"]
 
@@ -286,17 +549,54 @@ def upload_video(youtube, filepath: pathlib.Path, title: str, desc: str):
 def main():
     archive = pathlib.Path(ARCHIVE_DIR)
 
-    # 1) Choose latest night with >=1 meteor; handle duplicate night folders by picking the longest timelapse
-    yyyymmdd, night_folder, latest_video, meteor_count = pick_latest_night(archive, require_meteors=True)
+    state = load_state()
+
+    # 0) Finish an upload that an earlier run was interrupted in, instead of rebuilding and re-sending it
+    pending = state.get("pending_upload")
+    if pending and not DRY_RUN:
+        if pending_upload_matches(pending):
+            try:
+                vid = upload_video(get_youtube(), pathlib.Path(pending["filepath"]), pending["body"],
+                                   state=state, resumable_uri=pending["resumable_uri"],
+                                   pending_info={"source": pending["source"], "date": pending["date"]})
+            except HttpError as e:
+                # A 4xx (expired/invalid session, quota, bad request) will not fix itself on the next cron run,
+                # so give up on this session rather than blocking every future upload; 5xx is retried next run.
+                if not 400 <= e.resp.status < 500:
+                    raise
+                print(f"Could not resume stored upload (HTTP {e.resp.status}); starting over.")
+                state.pop("pending_upload", None)
+                save_state(state)
+            else:
+                record_upload(state, archive, pathlib.Path(pending["source"]), pending["date"], vid)
+                print("Done.")
+                return
+        else:
+            state.pop("pending_upload", None)
+            save_state(state)
+
+    # 1) Fast duplicate guard: nothing new since the last upload, so skip the archive scan entirely
+    if last_upload_is_latest(archive, state):
+        print("Latest file already uploaded. Exiting.")
+        return
+
+    # 2) Choose latest night with >=1 meteor; handle duplicate night folders by picking the largest timelapse
+    yyyymmdd, night_folder, latest_video, meteor_count = pick_latest_night(
+        archive, require_meteors=True, finalized=state["finalized_dates"])
+    save_state(state)  # keep meteor-less dates so they aren't rescanned next run
+    if yyyymmdd and not latest_video:
+        print("Latest night already uploaded. Exiting.")
+        return
     if not latest_video:
         print("No suitable night found (no timelapse or no meteors).")
         sys.exit(1)
 
-    # 2) Duplicate guard (skip if we already uploaded this exact file)
-    state = load_state()
+    # Full duplicate guard (skip if we already uploaded this exact file)
     if state.get("last_filepath") and os.path.exists(state["last_filepath"]):
         try:
             if os.path.samefile(state["last_filepath"], latest_video):
+                mark_date_uploaded(state, archive, yyyymmdd)
+                save_state(state)
                 print("Latest file already uploaded. Exiting.")
                 return
         except Exception:
@@ -304,25 +604,16 @@ def main():
 
     # 3) Gather images from the chosen night folder in your preferred order
     folder = latest_video.parent
-    images = []
-    for kw in IMAGE_KEYWORDS:
-        try:
-            match = next((f for f in folder.iterdir() if kw in f.name), None)
-        except FileNotFoundError:
-            match = None
-        if match:
-            images.append(match)
+    images = find_images(folder)
 
     # 4) Ensure the video is not still being written
-    size1 = latest_video.stat().st_size
-    time.sleep(3)
-    size2 = latest_video.stat().st_size
-    if size2 != size1:
+    if file_still_growing(latest_video):
         print("Newest timelapse is still growing. Try again later.")
         sys.exit(2)
 
     # 5) Build slideshow and concat
-    tw, th, tfps = probe_video_dims_fps(latest_video)
+    info = probe(latest_video)
+    tw, th, tfps = info["w"], info["h"], info["fps"]
     final_video = latest_video
     if images:
         slideshow = build_slideshow(images, folder / "images.mp4",
@@ -344,8 +635,7 @@ def main():
         desc += f"\nMeteors detected: {meteors}"
 
     # 7) Upload (or dry-run)
-    creds = get_credentials()
-    youtube = build("youtube", "v3", credentials=creds)
+    youtube = get_youtube()
 
     if DRY_RUN:
         print("WOULD UPLOAD FILE:", final_video)
@@ -353,10 +643,9 @@ def main():
         print("DESC:\n", desc)
         return
 
-    vid = upload_video(youtube, final_video, title, desc)
-    state["last_filepath"] = str(latest_video.resolve())
-    state["last_video_id"] = vid
-    save_state(state)
+    vid = upload_video(youtube, final_video, make_upload_body(title, desc), state=state,
+                       pending_info={"source": str(latest_video), "date": yyyymmdd})
+    record_upload(state, archive, latest_video, yyyymmdd, vid)
     print("Done.")
 
 if __name__ == "__main__":